@@ -1,9 +1,12 @@
 #!/usr/bin/python3
-import re
-from collections import defaultdict
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
+import gzip
 import os
+import sys
 import argparse
+from itertools import groupby, repeat
 
 # Function to parse arguments
 def parse_args():
@@ -13,102 +16,236 @@ def parse_args():
     parser.add_argument('--verboseall', action='store_true', help='Show all verbose outputs')
     parser.add_argument('--domain', type=str, help='Specify a domain to search for, or leave empty to search all domains')
     parser.add_argument('--daterange', type=str, help='Specify a date range in format dd/mm/yyyy-dd/mm/yyyy (default is last 24 hours)')
+    parser.add_argument('--archives', action='store_true', help='Also read the archived logs (domain-Mon-yyyy.gz) of each month in the date range, for ranges the current logs no longer cover')
     return parser.parse_args()
 
-# Parse command-line arguments
-args = parse_args()
-
 # Paths to the necessary files
 user_domain_file = '/etc/userdatadomains'
 log_directory = '/home/{user}/logs/'
-# Adjusted regex to match the provided Apache log format
-log_format = r'(?P<ip>\S+) \S+ \S+ \[(?P<time>[^\]]+)\] "(?P<request>[^"]+)" (?P<status>\d{3}) (?P<size>\S+) "(?P<referer>[^"]+)" "(?P<user_agent>[^"]+)"'
-
-# Dictionary to hold domain -> hourly -> IP -> request counts
-domain_stats = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
-
-# Determine the date range
-if args.daterange:
+# Maximum number of (hour, IP) keys held in memory before they are counted
+count_batch_size = 200000
+# Month abbreviations used in Apache timestamps
+month_numbers = {'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+                 'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12}
+
+# Function to count the requests in an iterable of raw (bytes) log lines.
+# Adds an (hour, IP) -> count entry to request_counts for each line within the
+# date range given as day ordinals.
+def scan_log(lines, start_ord, end_ord, request_counts):
+    # Cache of timestamp hour prefix -> hourly time frame, or False when the
+    # timestamp is malformed or outside the date range
+    time_cache = {}
+
+    # Collect (hour, IP) keys and count them in bulk with Counter.update
+    request_keys = []
+
+    # Bind lookups used on every line before entering the loop
+    get_cached_hour = time_cache.get
+    add_key = request_keys.append
+    intern = sys.intern
     try:
-        start_str, end_str = args.daterange.split('-')
-        start_date = datetime.strptime(start_str, '%d/%m/%Y')
-        end_date = datetime.strptime(end_str, '%d/%m/%Y')
-    except ValueError:
-        print("Invalid date range format. Please use dd/mm/yyyy-dd/mm/yyyy.")
-        exit(1)
-else:
-    # Default to the last 24 hours
-    end_date = datetime.now()
-    start_date = end_date - timedelta(days=1)
-
-# Step 1: Parse the domain list
-domains = {}
-with open(user_domain_file, 'r') as file:
-    for line in file:
-        parts = line.strip().split("==")
-        if len(parts) >= 2:
-            # Get domain and username
-            domain_name = parts[0].split(":")[0]  # Extracts domain before ":"
-            user = parts[0].split(":")[1].strip()  # Extracts and strips username after ":"
-            domains[domain_name] = user
-
-# Step 2: Parse logs for each domain/user
-for domain, user in domains.items():
-    if args.domain and args.domain != domain:
-        continue  # Skip domains that don't match the specified one
-
-    if args.verbosedomain or args.verboseall:
-        print(f"\n[INFO] Checking logs for domain '{domain}' (User: '{user}')")
+        for line in lines:
+            # Cheap prefilter: lines without a timestamp can never match
+            if b'[' not in line:
+                continue
+
+            # Pull the client IP and timestamp out of the combined log line,
+            # inline rather than in a helper to save a call on every line.
+            # The timestamp must open the fourth field (IP, ident, user, [time])
+            ip_end = line.find(b' ')
+            if ip_end < 1:
+                continue
+            time_start = line.find(b' [', ip_end) + 2
+            if time_start < 2 or line.count(b' ', ip_end + 1, time_start - 2) != 1:
+                continue
+            # Bracketed timestamps are 20-30 characters, with or without a timezone
+            if line.find(b']', time_start + 20, time_start + 31) < 0:
+                continue
+
+            # Parse and filter based on date, once per distinct hour
+            time_key = line[time_start:time_start + 14]  # dd/Mon/yyyy:HH
+            hour = get_cached_hour(time_key)
+            if hour is None:
+                try:
+                    stamp = time_key.decode('latin-1')
+                    year, month, day, log_hour = int(stamp[7:11]), month_numbers[stamp[3:6]], int(stamp[0:2]), int(stamp[12:14])
+                    log_ord = datetime(year, month, day, log_hour).toordinal()  # Also validates the fields
+                    if start_ord <= log_ord <= end_ord:
+                        hour = f"{year:04d}-{month:02d}-{day:02d} {log_hour:02d}:00"  # Hourly time frame
+                    else:
+                        hour = False  # Outside the date range
+                except (KeyError, ValueError):
+                    hour = False  # Malformed timestamp, not a log line
+                time_cache[time_key] = hour
+            if not hour:
+                continue
+
+            # Step 3: Update the count per hour -> IP for the domain
+            # Both fields are ASCII, only the IP is ever decoded. Interning
+            # shares one string (and its cached hash) per distinct IP
+            add_key((hour, intern(line[:ip_end].decode('latin-1'))))
+            if len(request_keys) >= count_batch_size:
+                request_counts.update(request_keys)
+                request_keys.clear()
+    finally:
+        request_counts.update(request_keys)
+
+# Function to list the months (as Mon-yyyy, the suffix of archived logs) in the date range
+def archive_months(start_date, end_date):
+    months = []
+    year, month = start_date.year, start_date.month
+    while (year, month) <= (end_date.year, end_date.month):
+        months.append(datetime(year, month, 1).strftime('%b-%Y'))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+# Function to parse the access logs of a single domain, run in a worker process.
+# Returns the domain, its (hour, IP) -> request counts and the messages to print.
+def process_domain(domain, user, start_ord, end_ord, start_time, months, verbose_domain, verbose_log):
+    messages = []
+    if verbose_domain:
+        messages.append(f"\n[INFO] Checking logs for domain '{domain}' (User: '{user}')")
 
     # Construct possible log file names
-    log_path_non_ssl = os.path.join(log_directory.format(user=user), f"{domain}")
-    log_path_ssl = os.path.join(log_directory.format(user=user), f"{domain}-ssl_log")  # Updated suffix
+    user_log_directory = log_directory.format(user=user)
+    log_path_non_ssl = os.path.join(user_log_directory, f"{domain}")
+    log_path_ssl = os.path.join(user_log_directory, f"{domain}-ssl_log")  # Updated suffix
+
+    # Archived logs (non-SSL and SSL) for each requested month. List the log
+    # directory once instead of probing every possible archive name.
+    archive_paths = []
+    if months:
+        try:
+            log_names = {entry.name for entry in os.scandir(user_log_directory)}
+        except OSError:
+            log_names = set()
+        archive_paths = [os.path.join(user_log_directory, name) for month in months
+                         for name in (f"{domain}-{month}.gz", f"{domain}-ssl_log-{month}.gz")
+                         if name in log_names]
 
     # Try to open each log file (non-SSL and SSL versions)
     processed_logs = False
+    request_counts = Counter()
     for log_path in [log_path_non_ssl, log_path_ssl]:
-        if args.verboselog or args.verboseall:
-            print(f"  [INFO] Checking for log file: {log_path}")
+        if verbose_log:
+            messages.append(f"  [INFO] Checking for log file: {log_path}")
 
         if not os.path.isfile(log_path):
-            print(f"    [WARNING] Log file '{log_path}' not found, skipping.")
+            messages.append(f"    [WARNING] Log file '{log_path}' not found, skipping.")
+            continue
+
+        # The file can be rotated away between the check above and the stat
+        try:
+            modified_time = os.path.getmtime(log_path)
+        except OSError:
+            messages.append(f"    [WARNING] Log file '{log_path}' not found, skipping.")
+            continue
+
+        # Logs last written before midnight of the first day cannot hold matching requests
+        if modified_time < start_time:
+            if verbose_log:
+                messages.append(f"    [INFO] Log file '{log_path}' was last modified before the date range, skipping.")
             continue
 
-        if args.verboselog or args.verboseall:
-            print(f"    [INFO] Processing log file '{log_path}'...")
+        if verbose_log:
+            messages.append(f"    [INFO] Processing log file '{log_path}'...")
         processed_logs = True
 
         try:
-            with open(log_path, 'r') as log_file:
-                for line in log_file:
-                    match = re.match(log_format, line)
-                    if match:
-                        # Parse and filter based on date
-                        time_str = match.group('time').split()[0]  # Remove timezone part
-                        log_time = datetime.strptime(time_str, '%d/%b/%Y:%H:%M:%S')
-                        log_date = log_time.date()
-
-                        if start_date.date() <= log_date <= end_date.date():
-                            ip = match.group('ip')
-                            hour = log_time.strftime('%Y-%m-%d %H:00')  # Hourly time frame
-
-                            # Step 3: Update the count per hour -> IP for the domain
-                            domain_stats[domain][hour][ip] += 1
+            with open(log_path, 'rb') as log_file:
+                scan_log(log_file, start_ord, end_ord, request_counts)
         except Exception as e:
-            print(f"    [ERROR] An error occurred while processing logs for domain '{domain}' in file '{log_path}': {e}")
+            messages.append(f"    [ERROR] An error occurred while processing logs for domain '{domain}' in file '{log_path}': {e}")
 
-    if processed_logs and (args.verbosedomain or args.verboseall):
-        print(f"  [INFO] Finished processing logs for domain '{domain}'.")
+    for archive_path in archive_paths:
+        if verbose_log:
+            messages.append(f"    [INFO] Processing archived log file '{archive_path}'...")
+        processed_logs = True
+
+        try:
+            with gzip.open(archive_path, 'rb') as archive_file:
+                scan_log(archive_file, start_ord, end_ord, request_counts)
+        except Exception as e:
+            messages.append(f"    [ERROR] An error occurred while processing logs for domain '{domain}' in file '{archive_path}': {e}")
 
-# Step 4: Output the results
-print("\n[INFO] Hourly request count per domain within the specified date range:")
-for domain, hourly_data in domain_stats.items():
-    print(f"\nDomain: {domain}")
-    for hour, ip_data in sorted(hourly_data.items()):
-        print(f"  Hour: {hour}")
-        for ip, count in ip_data.items():
-            print(f"    IP: {ip} - {count} requests")
+    if processed_logs and verbose_domain:
+        messages.append(f"  [INFO] Finished processing logs for domain '{domain}'.")
 
-    if args.verbosedomain or args.verboseall:
-        print(f"[INFO] Loaded domain '{domain}' for user '{user}'.")
+    return domain, request_counts, messages
 
+# Function to run the report for the command-line arguments
+def main():
+    # Parse command-line arguments
+    args = parse_args()
+    verbose_domain = args.verbosedomain or args.verboseall
+    verbose_log = args.verboselog or args.verboseall
+
+    # Dictionary to hold domain -> (hour, IP) -> request counts
+    domain_stats = {}
+
+    # Determine the date range
+    if args.daterange:
+        try:
+            start_str, end_str = args.daterange.split('-')
+            start_date = datetime.strptime(start_str, '%d/%m/%Y')
+            end_date = datetime.strptime(end_str, '%d/%m/%Y')
+        except ValueError:
+            print("Invalid date range format. Please use dd/mm/yyyy-dd/mm/yyyy.")
+            exit(1)
+    else:
+        # Default to the last 24 hours
+        end_date = datetime.now()
+        start_date = end_date - timedelta(days=1)
+
+    # Compare days as ordinals inside the log loop
+    start_ord = start_date.toordinal()
+    end_ord = end_date.toordinal()
+
+    # Start of the first day as a timestamp, to skip logs not written since
+    try:
+        start_time = datetime.fromordinal(start_ord).timestamp()
+    except (ValueError, OverflowError, OSError):
+        start_time = 0  # Not representable as a timestamp, don't skip any logs
+
+    # Months whose archived logs can hold requests in the date range, only when
+    # asked for: archives can repeat requests that are still in the current logs
+    months = archive_months(start_date, end_date) if args.archives else []
+
+    # Step 1: Parse the domain list
+    domains = {}
+    with open(user_domain_file, 'r') as file:
+        for line in file:
+            parts = line.strip().split("==")
+            if len(parts) >= 2:
+                # Get domain and username
+                domain_name = parts[0].split(":")[0]  # Extracts domain before ":"
+                user = parts[0].split(":")[1].strip()  # Extracts and strips username after ":"
+                domains[domain_name] = user
+
+    # Step 2: Parse logs for each domain/user, one domain per worker process
+    selected = {domain: user for domain, user in domains.items()
+                if not args.domain or args.domain == domain}  # Skip domains that don't match the specified one
+    with ProcessPoolExecutor() as executor:
+        results = executor.map(process_domain, selected.keys(), selected.values(),
+                               repeat(start_ord), repeat(end_ord), repeat(start_time), repeat(months),
+                               repeat(verbose_domain), repeat(verbose_log))
+        for domain, request_counts, messages in results:
+            for message in messages:
+                print(message)
+            if request_counts:
+                domain_stats[domain] = request_counts
+
+    # Step 4: Output the results
+    print("\n[INFO] Hourly request count per domain within the specified date range:")
+    for domain, request_counts in domain_stats.items():
+        print(f"\nDomain: {domain}")
+        for hour, ip_data in groupby(sorted(request_counts.items()), key=lambda item: item[0][0]):
+            print(f"  Hour: {hour}")
+            for (_, ip), count in ip_data:
+                print(f"    IP: {ip} - {count} requests")
+
+        if verbose_domain:
+            print(f"[INFO] Loaded domain '{domain}' for user '{user}'.")
+
+if __name__ == '__main__':
+    main()